@@ -1,9 +1,14 @@
+import hashlib
+import tempfile
+from io import BytesIO, StringIO
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
 import streamlit as st
 import plotly.express as px
 import plotly.graph_objects as go
 import requests
-from io import StringIO
 
 # --- Page Configuration ---
 st.set_page_config(
@@ -28,58 +33,118 @@ st.sidebar.title("📂 Data Source")
 # Unified File Uploader (Accepts both Excel and CSV)
 uploaded_file = st.sidebar.file_uploader("Upload File (Excel or CSV)", type=["xlsx", "csv"])
 
+# --- Column Name Aliases ---
+# Maps every known header variant to its canonical name. Trailing-space
+# variants are covered by stripping before lookup.
+ALIASES = {
+    'Total_Paid': 'App_Amount',
+    'Payment Amount': 'App_Amount',
+    'Total Paid': 'App_Amount',
+    'Total_PO_Value': 'App_PO_Value',
+    'Total PO Value': 'App_PO_Value',
+    'Actual_Payment_%': 'App_Percent',
+    'Payment %': 'App_Percent',
+    'PO_Date': 'App_Date',
+    'PO DATE': 'App_Date',
+    'Invoice Date': 'App_Date',
+    'PR DATE': 'App_Date',
+    'Vendor': 'Vendor_Name',
+    'VENDOR': 'Vendor_Name',
+    'Project Manager': 'Project_Manager',
+}
+
+
+# CSV uploads above this size are read in row chunks so the file is
+# never held twice in memory at full width. (Excel reads are always
+# single-shot: the engines materialize the whole sheet regardless.)
+LARGE_UPLOAD_BYTES = 25 * 1024 * 1024
+CHUNK_ROWS = 50_000
+
+# On-disk Parquet cache keyed by upload hash. st.cache_data lives in RAM
+# only, so after a container restart the XLSX would be reparsed from
+# scratch; a Parquet read of the cleaned frame is far cheaper.
+PARQUET_CACHE_DIR = Path(tempfile.gettempdir()) / 'uces_parquet_cache'
+
+# Salts the cache filename; the temp dir outlives deploys, so bump this
+# whenever load_data's cleaning/derived-column output changes or stale
+# frames from the old code get served back.
+PARQUET_SCHEMA_VERSION = 2
+
+def _upload_digest(data):
+    try:
+        import xxhash
+        return xxhash.xxh3_64(data).hexdigest()
+    except ImportError:
+        return hashlib.md5(data).hexdigest()
+
+# The aging arithmetic relies on App_Date_ns holding true nanoseconds.
+# Cheap startup check against a known date so a pandas resolution change
+# (e.g. datetime64[us] defaults) fails loudly instead of mis-bucketing.
+_probe = pd.Timestamp('2026-01-02')
+assert pd.Series([_probe]).astype('datetime64[ns]').astype('int64').iloc[0] == _probe.value
+
 # --- Data Processing Function ---
+# The upload is passed underscore-prefixed so Streamlit doesn't walk the
+# file object with its (slow) default hasher; the xxhash digest of the
+# bytes is the cache key.
 @st.cache_data
-def load_data(file, file_type):
+def load_data(_file, file_type, upload_digest):
+    file = _file
     try:
+        # 0. DISK CACHE CHECK (survives restarts, unlike st.cache_data)
+        cache_path = None
+        try:
+            PARQUET_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            cache_path = PARQUET_CACHE_DIR / f'{upload_digest}-v{PARQUET_SCHEMA_VERSION}.parquet'
+            if cache_path.exists():
+                return pd.read_parquet(cache_path)
+        except Exception:
+            cache_path = None
+
         # 1. Read File
+        # Known text columns - skips pandas' type-inference pass
+        dtype_hints = {'Vendor_Name': 'string', 'Project_Manager': 'string', 'PO No': 'string'}
+
         if file_type == "excel":
-            df = pd.read_excel(file)
+            try:
+                # calamine (Rust reader) parses XLSX several times faster than openpyxl
+                import python_calamine  # noqa: F401
+                engine = 'calamine'
+            except ImportError:
+                engine = 'openpyxl'
+            # Read every column: the Raw Data tab and the CSV export show
+            # the full frame, so unrecognized columns (Notes, Remarks, ...)
+            # must survive the load.
+            # Single-shot read: skiprows/nrows passes don't stream - the
+            # engine materializes the whole sheet on every pass, so looping
+            # only multiplies parse cost without lowering peak memory.
+            df = pd.read_excel(file, engine=engine, dtype=dtype_hints)
         elif file_type == "csv":
-            df = pd.read_csv(file)
+            # Full-width read here too - same policy as the Excel branch
+            csv_kwargs = dict(dtype=dtype_hints)
+            if getattr(file, 'size', 0) > LARGE_UPLOAD_BYTES:
+                chunks = pd.read_csv(file, chunksize=CHUNK_ROWS, **csv_kwargs)
+                df = pd.concat(list(chunks), ignore_index=True, copy=False)
+            else:
+                df = pd.read_csv(file, **csv_kwargs)
         else:
             return pd.DataFrame()
             
-        # 2. Clean Column Names
-        df.columns = [str(c).strip() for c in df.columns]
-        
-        # 3. LOGIC MAP
-        renamed_cols = {}
-        
-        if 'App_Amount' in df.columns: pass 
-        elif 'Total_Paid' in df.columns: renamed_cols['Total_Paid'] = 'App_Amount'
-        elif 'Payment Amount' in df.columns: renamed_cols['Payment Amount'] = 'App_Amount'
-        elif 'Total Paid' in df.columns: renamed_cols['Total Paid'] = 'App_Amount'
-        
-        if 'App_PO_Value' in df.columns: pass
-        elif 'Total_PO_Value' in df.columns: renamed_cols['Total_PO_Value'] = 'App_PO_Value'
-        elif 'Total PO Value' in df.columns: renamed_cols['Total PO Value'] = 'App_PO_Value'
-        elif 'Total PO Value ' in df.columns: renamed_cols['Total PO Value '] = 'App_PO_Value'
-        
-        if 'App_Percent' in df.columns: pass
-        elif 'Actual_Payment_%' in df.columns: renamed_cols['Actual_Payment_%'] = 'App_Percent'
-        elif 'Payment %' in df.columns: renamed_cols['Payment %'] = 'App_Percent'
-        elif 'Actual_Payment_% ' in df.columns: renamed_cols['Actual_Payment_% '] = 'App_Percent'
-        
-        if 'App_Date' in df.columns: pass
-        elif 'PO_Date' in df.columns: renamed_cols['PO_Date'] = 'App_Date'
-        elif 'PO DATE' in df.columns: renamed_cols['PO DATE'] = 'App_Date'
-        elif 'PO_Date ' in df.columns: renamed_cols['PO_Date '] = 'App_Date'
-        elif 'Invoice Date' in df.columns: renamed_cols['Invoice Date'] = 'App_Date'
-        elif 'Invoice Date ' in df.columns: renamed_cols['Invoice Date '] = 'App_Date'
-        elif 'PR DATE' in df.columns: renamed_cols['PR DATE'] = 'App_Date'
-
-        if 'Vendor_Name' in df.columns: pass
-        elif 'Vendor' in df.columns: renamed_cols['Vendor'] = 'Vendor_Name'
-        elif 'VENDOR' in df.columns: renamed_cols['VENDOR'] = 'Vendor_Name'
-        
-        if 'Project_Manager' in df.columns: pass
-        elif 'Project Manager' in df.columns: renamed_cols['Project Manager'] = 'Project_Manager'
-        elif 'Project Manager ' in df.columns: renamed_cols['Project Manager '] = 'Project_Manager'
-
-        # Apply Renaming
-        if renamed_cols:
-            df = df.rename(columns=renamed_cols)
+        # 2+3. Clean & Canonicalize Column Names (single pass, no rename chain)
+        stripped = [str(c).strip() for c in df.columns]
+        present = set(stripped)
+        new_cols = []
+        taken = set()
+        for c in stripped:
+            target = ALIASES.get(c, c)
+            # Keep the original name if the canonical one already exists
+            # (or a previous alias claimed it) to avoid duplicate columns.
+            if target != c and (target in present or target in taken):
+                new_cols.append(c)
+            else:
+                new_cols.append(target)
+                taken.add(target)
+        df.columns = new_cols
 
         # 4. ENSURE CRITICAL COLUMNS EXIST
         if 'App_Amount' not in df.columns:
@@ -95,16 +160,47 @@ def load_data(file, file_type):
         else:
             df['App_Date'] = pd.Timestamp.now()
 
-        # 6. HANDLE NUMERIC COLUMNS
+        # Integer-ns mirror of App_Date so age arithmetic is a plain int64
+        # subtract, with no .dt accessor in the hot path. The explicit
+        # datetime64[ns] cast matters: newer pandas parses dates at
+        # microsecond resolution, and a bare astype('int64') would store
+        # us while Timestamp.value is always ns.
+        df['App_Date_ns'] = df['App_Date'].astype('datetime64[ns]').astype('int64')
+
+        # 6. HANDLE NUMERIC COLUMNS (vectorized - no per-cell Python calls)
         numeric_cols = ['App_Amount', 'App_PO_Value', 'App_Percent']
         for col in numeric_cols:
             if col in df.columns:
-                def to_float(val):
-                    try:
-                        return float(str(val).replace(',', '').replace('RM', '').replace('-', '0').strip())
-                    except:
-                        return 0.0
-                df[col] = df[col].apply(to_float).fillna(0)
+                if pd.api.types.is_numeric_dtype(df[col]):
+                    df[col] = df[col].fillna(0)
+                    continue
+                s = (df[col].astype('string')
+                     .str.replace(',', '', regex=False)
+                     .str.replace('RM', '', regex=False)
+                     .str.replace('-', '0', regex=False)
+                     .str.strip())
+                df[col] = pd.to_numeric(s, errors='coerce').fillna(0.0).astype('float64')
+
+        # 7. SHRINK MEMORY FOOTPRINT
+        # float32 halves bandwidth for the sums/groupbys; category encodes
+        # the high-repetition text columns as integer codes.
+        for col in numeric_cols:
+            if col in df.columns:
+                df[col] = pd.to_numeric(df[col], downcast='float')
+        for col in ('Vendor_Name', 'Project_Manager'):
+            if col in df.columns:
+                df[col] = df[col].astype('category')
+
+        # 8. SORT ONCE (newest first) - mask filters preserve order, so
+        # downstream views never re-sort.
+        df = df.sort_values('App_Date', ascending=False, kind='stable').reset_index(drop=True)
+
+        # 9. PERSIST TO DISK CACHE
+        if cache_path is not None:
+            try:
+                df.to_parquet(cache_path, compression='zstd')
+            except Exception:
+                pass
 
         return df
 
@@ -112,6 +208,108 @@ def load_data(file, file_type):
         st.error(f"❌ Error loading file: {e}")
         return pd.DataFrame()
 
+# --- Cached Derived Frames ---
+# Leading-underscore args are skipped by Streamlit's hasher; the cheap
+# scalar key (upload identity + filter state) drives cache lookups instead
+# of hashing the whole DataFrame on every rerun.
+@st.cache_data
+def _vendor_lower(_df, vendor_col, file_key):
+    # Lowercased once per upload so each search keystroke only does a
+    # plain C substring scan instead of re-lowercasing the whole column.
+    return _df[vendor_col].str.lower().fillna('')
+
+@st.cache_data
+def _pending_mask(_df, file_key):
+    # Computed once per upload; shared by the status filter and the aging tab
+    return _df['App_Percent'].to_numpy() < 99.9
+
+@st.cache_data
+def filter_df(_df, pm_col, vendor_col, selected_pm, vendor_search, status_filter, cache_key):
+    # Combine all three filters into one boolean mask and index once,
+    # instead of materializing an intermediate frame per filter.
+    mask = np.ones(len(_df), dtype=bool)
+    if selected_pm != 'All' and pm_col in _df.columns:
+        mask &= (_df[pm_col].to_numpy() == selected_pm)
+    if vendor_search and vendor_col in _df.columns:
+        mask &= _vendor_lower(_df, vendor_col, cache_key[:1]).str.contains(
+            vendor_search.lower(), regex=False).to_numpy()
+    if status_filter == "Fully Paid (100%)":
+        mask &= ~_pending_mask(_df, cache_key[:1])
+    elif status_filter == "Partial / Pending":
+        mask &= _pending_mask(_df, cache_key[:1])
+    return _df.loc[mask]
+
+@st.cache_data
+def pm_aggregate(_df_view, pm_col, cache_key):
+    # One hash build serves both the Spend-by-PM and Budget-vs-Actual charts
+    return _df_view.groupby(pm_col, observed=True).agg(
+        Paid=('App_Amount', 'sum'),
+        Budget=('App_PO_Value', 'sum')
+    ).reset_index()
+
+@st.cache_data
+def monthly_cashflow(_df_view, cache_key):
+    # Group on the period series directly - no frame copy, no extra column.
+    # load_data guarantees App_Date is already datetime64.
+    periods = _df_view['App_Date'].dt.to_period('M').rename('YearMonth')
+
+    monthly_stats = _df_view.groupby(periods).agg(
+        Paid=('App_Amount', 'sum'),
+        PO_Value=('App_PO_Value', 'sum')
+    ).reset_index()
+
+    monthly_stats['Outstanding'] = monthly_stats['PO_Value'] - monthly_stats['Paid']
+    return monthly_stats
+
+@st.cache_data
+def compute_aging(_df_view, _df, cache_key, today):
+    # `today` is part of the cache key: ages must roll over at midnight
+    # even in a long-lived process, not freeze at first computation.
+    # _df_view's index holds positions into the base frame (load_data does
+    # reset_index), so the precomputed base mask slices straight in.
+    pending_df = _df_view.loc[_pending_mask(_df, cache_key[:1])[_df_view.index.to_numpy()]].copy()
+
+    if 'App_Date_ns' in pending_df.columns:
+        today_ns = today.value
+        date_ns = pending_df['App_Date_ns'].to_numpy()
+        age_days = (today_ns - date_ns) // 86_400_000_000_000
+        # NaT encodes as int64 min; keep those in the 90+ bucket
+        age_days = np.where(date_ns == np.iinfo('int64').min, 9999, age_days)
+        pending_df['Age_Days'] = age_days.astype('int32')
+    elif 'App_Date' in pending_df.columns:
+        # NaT dates land in the 90+ bucket, same as the old if-chain
+        pending_df['Age_Days'] = (today - pending_df['App_Date']).dt.days.fillna(9999).astype('int32')
+    else:
+        pending_df['Age_Days'] = 0
+
+    pending_df['Age_Bucket'] = pd.cut(
+        pending_df['Age_Days'],
+        bins=[-np.inf, 30, 60, 90, np.inf],
+        labels=['0-30 Days', '31-60 Days', '61-90 Days', '90+ Days']
+    )
+
+    count_col = 'PO No' if 'PO No' in pending_df.columns else pending_df.columns[0]
+
+    aging_data = pending_df.groupby('Age_Bucket').agg(
+        Count=(count_col, 'count'),
+        Total_Value=('App_PO_Value', 'sum')
+    ).reset_index()
+    return pending_df, aging_data
+
+@st.cache_data
+def to_csv_bytes(_df_view, cache_key):
+    # App_Date_ns is an internal mirror column; keep it out of the export
+    _df_view = _df_view.drop(columns=['App_Date_ns'], errors='ignore')
+    try:
+        # Arrow's C++ CSV writer is several times faster than pandas' own
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+        buf = BytesIO()
+        pa_csv.write_csv(pa.Table.from_pandas(_df_view, preserve_index=False), buf)
+        return buf.getvalue()
+    except Exception:
+        return _df_view.to_csv(index=False).encode('utf-8')
+
 # --- Main Execution Logic ---
 df = None
 
@@ -130,8 +328,10 @@ if uploaded_file:
         st.info("🟡 Detected: Unknown File Type")
         file_type = "unknown"
 
-    df = load_data(uploaded_file, file_type)
-    
+    upload_digest = _upload_digest(uploaded_file.getvalue())
+    df = load_data(uploaded_file, file_type, upload_digest)
+    file_key = (upload_digest,)
+
     if not df.empty:
         st.success(f"✅ Data loaded successfully! {len(df)} rows found.")
         st.markdown("---")
@@ -152,12 +352,13 @@ with tab1:
     # --- KPIs ---
     col1, col2, col3, col4 = st.columns(4)
     
-    total_spend = df['App_Amount'].sum()
-    total_po_value = df['App_PO_Value'].sum()
-    
+    # Single numpy pass per column - no intermediate frames
+    total_spend = float(df['App_Amount'].to_numpy().sum())
+    total_po_value = float(df['App_PO_Value'].to_numpy().sum())
+
     vendor_col = 'Vendor_Name' if 'Vendor_Name' in df.columns else 'VENDOR'
     unique_vendors = df[vendor_col].nunique() if vendor_col in df.columns else 0
-    pending_pos = len(df[df['App_Percent'] < 99.9])
+    pending_pos = int(np.count_nonzero(_pending_mask(df, file_key)))
 
     col1.metric("Total Payments", f"RM {total_spend:,.2f}")
     col2.metric("Total PO Value", f"RM {total_po_value:,.2f}")
@@ -169,31 +370,23 @@ with tab1:
     # --- Filters ---
     with st.sidebar:
         st.header("🔍 Filters")
-        
+
         # PM Filter
         pm_col = 'Project_Manager' if 'Project_Manager' in df.columns else 'Project Manager'
         if pm_col in df.columns:
             pm_list = ['All'] + sorted(df[pm_col].dropna().unique().tolist())
             selected_pm = st.selectbox("Project Manager", pm_list)
-            if selected_pm != 'All':
-                df_view = df[df[pm_col] == selected_pm]
-            else:
-                df_view = df
         else:
-            df_view = df
+            selected_pm = 'All'
 
         # Vendor Filter
-        if vendor_col in df.columns:
-            vendor_search = st.sidebar.text_input("Search Vendor Name")
-            if vendor_search:
-                df_view = df_view[df_view[vendor_col].str.contains(vendor_search, case=False, na=False)]
+        vendor_search = st.sidebar.text_input("Search Vendor Name") if vendor_col in df.columns else ''
 
         # Status Filter
         status_filter = st.radio("Payment Status", ["All", "Fully Paid (100%)", "Partial / Pending"])
-        if status_filter == "Fully Paid (100%)":
-            df_view = df_view[df_view['App_Percent'] >= 99.9]
-        elif status_filter == "Partial / Pending":
-            df_view = df_view[df_view['App_Percent'] < 99.9]
+
+    filter_key = file_key + (selected_pm, vendor_search, status_filter)
+    df_view = filter_df(df, pm_col, vendor_col, selected_pm, vendor_search, status_filter, filter_key)
 
     # --- Charts ---
     c1, c2 = st.columns(2)
@@ -201,14 +394,14 @@ with tab1:
     with c1:
         st.subheader("Spend by Project Manager")
         if pm_col in df.columns:
-            pm_spend = df_view.groupby(pm_col)['App_Amount'].sum().reset_index()
-            fig_pm = px.bar(pm_spend, x=pm_col, y='App_Amount', color='App_Amount', template='plotly_white')
+            pm_spend = pm_aggregate(df_view, pm_col, filter_key)
+            fig_pm = px.bar(pm_spend, x=pm_col, y='Paid', color='Paid', template='plotly_white')
             st.plotly_chart(fig_pm, use_container_width=True)
     
     with c2:
         st.subheader("Vendor Concentration (Top 10)")
         if vendor_col in df.columns:
-            top_vendors = df_view.groupby(vendor_col)['App_Amount'].sum().sort_values(ascending=False).head(10).reset_index()
+            top_vendors = df_view.groupby(vendor_col, observed=True)['App_Amount'].sum().nlargest(10).reset_index()
             if not top_vendors.empty:
                 fig_vendor = px.pie(top_vendors, values='App_Amount', names=vendor_col, hole=0.4)
                 st.plotly_chart(fig_vendor, use_container_width=True)
@@ -235,10 +428,9 @@ with tab1:
         elif fallback in df.columns:
             actual_display_cols.append(fallback)
             
-    df_view_sorted = df_view.sort_values(by='App_Date', ascending=False)
-
+    # df is kept sorted by App_Date descending in load_data
     st.dataframe(
-        df_view_sorted[actual_display_cols], 
+        df_view[actual_display_cols],
         use_container_width=True,
         column_config={
             "App_Amount": st.column_config.NumberColumn("Total Paid (RM)", format="RM %.2f"),
@@ -255,16 +447,9 @@ with tab2:
     # 1. Financial Health (Cash Flow)
     st.subheader("💰 Financial Health (Payment vs. Outstanding)")
     
-    daily_flow = df_view.copy()
-    daily_flow['YearMonth'] = pd.to_datetime(daily_flow['App_Date']).dt.to_period('M')
-    
-    monthly_stats = daily_flow.groupby('YearMonth').agg(
-        Paid=('App_Amount', 'sum'),
-        PO_Value=('App_PO_Value', 'sum')
-    ).reset_index()
-    
-    monthly_stats['Outstanding'] = monthly_stats['PO_Value'] - monthly_stats['Paid']
-    
+    monthly_stats = monthly_cashflow(df_view, filter_key)
+
+
     fig_flow = go.Figure()
     fig_flow.add_trace(go.Bar(x=monthly_stats['YearMonth'].astype(str), y=monthly_stats['Paid'], name='Paid Amount', marker_color='#2ECC71'))
     fig_flow.add_trace(go.Bar(x=monthly_stats['YearMonth'].astype(str), y=monthly_stats['Outstanding'], name='Outstanding Balance', marker_color='#E74C3C'))
@@ -278,11 +463,8 @@ with tab2:
     st.subheader("🏗️ Project Budget vs. Actual Spend")
     
     if pm_col in df.columns:
-        project_spend = df_view.groupby(pm_col).agg(
-            Budget=('App_PO_Value', 'sum'), 
-            Actual=('App_Amount', 'sum')
-        ).reset_index()
-        
+        project_spend = pm_aggregate(df_view, pm_col, filter_key).rename(columns={'Paid': 'Actual'})
+
         project_spend['Variance'] = project_spend['Budget'] - project_spend['Actual']
         project_spend = project_spend.sort_values(by='Budget', ascending=False)
         
@@ -300,29 +482,9 @@ with tab2:
     # 3. Aging Analysis
     st.subheader("⏳ Pending Invoice Analysis (Aging)")
     
-    pending_df = df_view[df_view['App_Percent'] < 99.9]
-    
-    if 'App_Date' in pending_df.columns:
-        today = pd.Timestamp.now()
-        pending_df['Age_Days'] = (today - pending_df['App_Date']).dt.days
-    else:
-        pending_df['Age_Days'] = 0
+    pending_df, aging_data = compute_aging(df_view, df, filter_key, pd.Timestamp.now().normalize())
+
 
-    def get_age_bucket(days):
-        if days <= 30: return '0-30 Days'
-        elif days <= 60: return '31-60 Days'
-        elif days <= 90: return '61-90 Days'
-        else: return '90+ Days'
-    
-    pending_df['Age_Bucket'] = pending_df['Age_Days'].apply(get_age_bucket)
-    
-    count_col = 'PO No' if 'PO No' in pending_df.columns else pending_df.columns[0]
-    
-    aging_data = pending_df.groupby('Age_Bucket').agg(
-        Count=(count_col, 'count'),
-        Total_Value=('App_PO_Value', 'sum')
-    ).reset_index()
-    
     fig_aging = px.bar(aging_data, x='Age_Bucket', y='Total_Value', color='Age_Bucket', template='plotly_white', text='Total_Value')
     fig_aging.update_layout(yaxis_title="Outstanding Amount (RM)", xaxis_title="Invoice Age", showlegend=False)
     st.plotly_chart(fig_aging, use_container_width=True)
@@ -336,13 +498,13 @@ with tab3:
     st.header("📋 Raw Data View")
     
     st.dataframe(
-        df.sort_values(by='App_Date', ascending=False),
+        df.drop(columns=['App_Date_ns'], errors='ignore'),
         use_container_width=True,
         height=400
     )
 
 # --- Download Button ---
-csv = df_view.to_csv(index=False).encode('utf-8')
+csv = to_csv_bytes(df_view, filter_key)
 
 st.download_button(
     label="📥 Download Filtered Data",